@@ -3,15 +3,17 @@ import base64
 import requests
 from util.logger import get_logger
 from util.common import get_days_ago
+from util.scheduler import FIXED_REQUEST_TIMEOUT, OutcomeUnknown
 from datetime import datetime
 
 log = get_logger()
 
 class PayPalClient:
-    def __init__(self) -> None:
+    def __init__(self, scheduler=None) -> None:
         self.client_id = os.environ.get('PAYPAL_CLIENT_ID')
         self.client_secret = os.environ.get('PAYPAL_CLIENT_SECRET')
         self.api_url = os.environ.get('PAYPAL_CLIENT_URL')
+        self.scheduler = scheduler
         self.token = self.get_access_token()
 
     def get_access_token(self):
@@ -24,10 +26,17 @@ class PayPalClient:
             "grant_type": "client_credentials",
             "scope": "https://uri.paypal.com/services/payments/payment/authcapture https://uri.paypal.com/services/payments/refund"
         }
-        response = requests.post(f"{self.api_url}/v1/oauth2/token", headers=headers, data=data)
+        response = requests.post(f"{self.api_url}/v1/oauth2/token", headers=headers, data=data, timeout=FIXED_REQUEST_TIMEOUT)
         response.raise_for_status()
         return response.json()['access_token']
     
+    def _request_timeout(self):
+        return self.scheduler.request_timeout() if self.scheduler else None
+
+    def _check_budget(self):
+        if self.scheduler:
+            self.scheduler.check_budget()
+
     def get_transaction_details(self, transaction_id):
         log.info(f"Fetching transaction details for Transaction ID: {transaction_id}")
         headers = {
@@ -37,7 +46,7 @@ class PayPalClient:
 
         url = f"{self.api_url}/v2/payments/captures/{transaction_id}"
 
-        response = requests.get(url, headers=headers)
+        response = requests.get(url, headers=headers, timeout=self._request_timeout())
         
         response.raise_for_status()
         return response.json()
@@ -52,8 +61,12 @@ class PayPalClient:
 
         url = f'{self.api_url}/v2/payments/captures/{transaction_id}/refund'
 
-        # Make the request to refund the payment
-        response = requests.post(url, headers=headers, json={})
+        # Make the request to refund the payment, a write is never started past the budget nor cut off by it
+        self._check_budget()
+        try:
+            response = requests.post(url, headers=headers, json={}, timeout=FIXED_REQUEST_TIMEOUT)
+        except requests.exceptions.Timeout:
+            raise OutcomeUnknown(f"refund request for Transaction ID {transaction_id} timed out")
 
         response.raise_for_status()
         return response.json()
@@ -68,7 +81,7 @@ class PayPalClient:
 
         url = f'{self.api_url}/v2/payments/refunds/{transaction_id}'
 
-        response = requests.get(url, headers=headers)
+        response = requests.get(url, headers=headers, timeout=self._request_timeout())
 
         response.raise_for_status()
         return response.json()
@@ -6,16 +6,18 @@ from util.logger import get_logger
 from datetime import datetime, timedelta
 from query.shopify import get_pending_orders_query, get_mark_paid_order_query, get_cancel_order_query, get_fetching_cancelled_orders_query
 from util.handler import handle_rate_limiting, handle_status_codes
+from util.scheduler import FIXED_REQUEST_TIMEOUT, OutcomeUnknown
 
 log = get_logger()
 
 class ShopifyAPIClient:
-    def __init__(self, paypal_client, slack_client):
+    def __init__(self, paypal_client, slack_client, scheduler=None):
         self.api_key = os.environ.get('SHOPIFY_API_KEY')
         self.store_domain = os.environ.get('SHOPIFY_STORE_DOMAIN')
         self.endpoint = f"https://{self.store_domain}/admin/api/2024-07/graphql.json"
         self.paypal_client = paypal_client
         self.slack_client = slack_client
+        self.scheduler = scheduler
         self.headers = {
             "Content-Type": "application/json",
             "X-Shopify-Access-Token": self.api_key
@@ -24,11 +26,17 @@ class ShopifyAPIClient:
     def fetch_pending_orders(self):
         cursor = None
         has_next_page = True
+        truncated = False
         all_orders = []
 
         while has_next_page:
             query = get_pending_orders_query(cursor)
-            response = self._make_pending_order_request(query)
+            try:
+                response = self._make_pending_order_request(query)
+            except requests.exceptions.Timeout:
+                log.warning("Shopify request timed out within the sync time budget, the remaining pages are left for the next run")
+                truncated = True
+                break
 
             if not handle_status_codes(response):
                 break  # Exit if there is an error
@@ -38,19 +46,12 @@ class ShopifyAPIClient:
             orders = data['edges']
             for order in orders:
                 order_data = order['node']
-                log.info(f"Fetching transaction details for order data {order_data}")
 
-                # Filter out the most recent transaction
+                # Filter out the most recent transaction, PayPal details are looked up once the order is scheduled
                 recent_transaction = max(order_data['transactions'], key=lambda t: datetime.strptime(t['createdAt'], "%Y-%m-%dT%H:%M:%SZ"))
-
-                # Fetch the transaction details from the Paypal API
-                paypal_details = self.paypal_client.get_transaction_details(recent_transaction['authorizationCode'])
-                if paypal_details:
-                    recent_transaction['paypal_details'] = paypal_details
-                
                 order_data['transactions'] = [recent_transaction]
                 
-                log.info(f"Fetched complete order details {order_data}")
+                log.info(f"Fetched order details {order_data}")
                 all_orders.append(order_data)
 
             # Pagination handling
@@ -61,12 +62,32 @@ class ShopifyAPIClient:
 
         log.info("Finished calling Shopify endpoint for fetching orders")
 
-        return all_orders
+        # truncated tells the caller that unfetched pages were left for the next run
+        return all_orders, truncated
+
+    def _request_timeout(self):
+        return self.scheduler.request_timeout() if self.scheduler else None
+
+    def _check_budget(self):
+        # Writes are never started past the budget nor cut off by it
+        if self.scheduler:
+            self.scheduler.check_budget()
+
+    def attach_paypal_details(self, order):
+        transaction = order['transactions'][0]
+        log.info(f"Fetching transaction details for order {order['id']}")
+
+        # Fetch the transaction details from the Paypal API
+        paypal_details = self.paypal_client.get_transaction_details(transaction['authorizationCode'])
+        if paypal_details:
+            transaction['paypal_details'] = paypal_details
+
+        return order
 
     def _make_pending_order_request(self, query):
         while True:
             log.info("Calling Shopify API to fetch orders")
-            response = requests.post(self.endpoint, headers=self.headers, json={'query': query})
+            response = requests.post(self.endpoint, headers=self.headers, json={'query': query}, timeout=self._request_timeout())
 
             # Rate limiting handling
             if handle_rate_limiting(response):
@@ -83,10 +104,14 @@ class ShopifyAPIClient:
         }
         
         # Execute the request
-        response = requests.post(self.endpoint, headers=self.headers, data=json.dumps({
-            "query": get_mark_paid_order_query(),
-            "variables": variables
-        }))
+        self._check_budget()
+        try:
+            response = requests.post(self.endpoint, headers=self.headers, data=json.dumps({
+                "query": get_mark_paid_order_query(),
+                "variables": variables
+            }), timeout=FIXED_REQUEST_TIMEOUT)
+        except requests.exceptions.Timeout:
+            raise OutcomeUnknown(f"marking order {order_id} as paid timed out")
         
         # Handle response
         if response.status_code == 200:
@@ -112,10 +137,14 @@ class ShopifyAPIClient:
         }
         
         # Send the request
-        response = requests.post(self.endpoint, headers=self.headers, data=json.dumps({
-            "query": get_cancel_order_query(),
-            "variables": variables
-        }))
+        self._check_budget()
+        try:
+            response = requests.post(self.endpoint, headers=self.headers, data=json.dumps({
+                "query": get_cancel_order_query(),
+                "variables": variables
+            }), timeout=FIXED_REQUEST_TIMEOUT)
+        except requests.exceptions.Timeout:
+            raise OutcomeUnknown(f"cancelling order {order_id} timed out")
         
         # Handle the response
         if response.status_code == 200:
@@ -173,11 +202,17 @@ class ShopifyAPIClient:
     def fetch_cancelled_orders(self):
         cursor = None
         has_next_page = True
+        truncated = False
         all_orders = []
 
         while has_next_page:
             query = get_fetching_cancelled_orders_query(cursor)
-            response = self._make_cancelled_order_request(query)
+            try:
+                response = self._make_cancelled_order_request(query)
+            except requests.exceptions.Timeout:
+                log.warning("Shopify request timed out within the sync time budget, the remaining pages are left for the next run")
+                truncated = True
+                break
 
             if not handle_status_codes(response):
                 break  # Exit if there is an error
@@ -187,20 +222,14 @@ class ShopifyAPIClient:
             orders = data['edges']
             for order in orders:
                 order_data = order['node']
-                log.info(f"Fetching transaction details for order data {order_data}")
 
-                # Filter out the most recent transaction
+                # Filter out the most recent transaction, PayPal details are looked up once the order is scheduled
                 recent_transaction = max(order_data['transactions'], key=lambda t: datetime.strptime(t['createdAt'], "%Y-%m-%dT%H:%M:%SZ"))
 
                 if recent_transaction['authorizationCode']:
-                    # Fetch the transaction details from the Paypal API
-                    paypal_details = self.paypal_client.get_transaction_details(recent_transaction['authorizationCode'])
-                    if paypal_details:
-                        recent_transaction['paypal_details'] = paypal_details
-                    
                     order_data['transactions'] = [recent_transaction]
                     
-                    log.info(f"Fetched complete order details {order_data}")
+                    log.info(f"Fetched order details {order_data}")
                     all_orders.append(order_data)
                 else:
                     log.info(f"Authorization code does not exists for order {order_data['name']}")
@@ -213,12 +242,13 @@ class ShopifyAPIClient:
 
         log.info("Finished calling Shopify endpoint for fetching cancelled orders")
 
-        return all_orders
+        # truncated tells the caller that unfetched pages were left for the next run
+        return all_orders, truncated
     
     def _make_cancelled_order_request(self, query):
         while True:
             log.info("Calling Shopify API to fetch cancelled orders")
-            response = requests.post(self.endpoint, headers=self.headers, json={'query': query})
+            response = requests.post(self.endpoint, headers=self.headers, json={'query': query}, timeout=self._request_timeout())
 
             # Rate limiting handling
             if handle_rate_limiting(response):
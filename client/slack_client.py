@@ -26,6 +26,36 @@ class SlackClient():
 
         log.info(f'Sync notification sent to the slack channel #{self.channel}')
 
+    def send_deferred_notification(self, table, name):
+        '''Method to report orders deferred to the next run by the time budget'''
+        self.client.chat_postMessage(
+            channel=self.channel,
+            text=f"The {name} automation ran out of its time budget. These orders are deferred to the next run. Orders marked Last Chance leave the 30 day sync window before then and need manual follow-up: \n ```\n{table}\n```",
+            username=self.username
+        )
+
+        log.info(f'Deferred orders notification sent to the slack channel #{self.channel}')
+
+    def send_outcome_unknown_notification(self, table, name):
+        '''Method to report orders whose PayPal or Shopify update timed out and may have gone through'''
+        self.client.chat_postMessage(
+            channel=self.channel,
+            text=f"The {name} automation timed out while updating these orders. The update may have gone through, please check them by hand before the next run: \n ```\n{table}\n```",
+            username=self.username
+        )
+
+        log.info(f'Outcome unknown notification sent to the slack channel #{self.channel}')
+
+    def send_partial_fetch_notification(self, fetched, name):
+        '''Method to report that fetching orders from Shopify timed out before the last page'''
+        self.client.chat_postMessage(
+            channel=self.channel,
+            text=f"The {name} automation timed out fetching orders from Shopify after {fetched} orders. Orders on the remaining pages are deferred to the next run.",
+            username=self.username
+        )
+
+        log.info(f'Partial fetch notification sent to the slack channel #{self.channel}')
+
     def create_csv_file(self, data, file_path=None):
         if not file_path:
             file_path = f"reports/{datetime.now().strftime("%Y-%m-%d")}_daily-report.csv"
@@ -1,3 +1,4 @@
+import requests
 from datetime import datetime
 from dotenv import load_dotenv
 from util.logger import get_logger
@@ -5,6 +6,7 @@ from prettytable import PrettyTable
 from client.slack_client import SlackClient
 from client.paypal_api_client import PayPalClient
 from client.shopify_api_client import ShopifyAPIClient
+from util.scheduler import SyncScheduler
 
 load_dotenv()
 
@@ -13,40 +15,66 @@ log = get_logger()
 def main():
     log.info(f"Sync Cancelled Orders Job running at {datetime.now()}")
 
+    # Start the time budget before fetching so the whole run is bounded
+    scheduler = SyncScheduler()
+
     # Initialize PayPal client
-    paypal_client = PayPalClient()
+    paypal_client = PayPalClient(scheduler)
 
     # Initialize Slack Client
     slack_client = SlackClient()
 
     # Initialize Shopify client
-    shopify_client = ShopifyAPIClient(paypal_client, slack_client)
+    shopify_client = ShopifyAPIClient(paypal_client, slack_client, scheduler)
 
     # Fetch Cancelled Orders
     log.info("Fetching cancelled orders from the last 30 days...")
-    orders = shopify_client.fetch_cancelled_orders()
+    orders, truncated = shopify_client.fetch_cancelled_orders()
+
+    # Orders on pages that were never fetched are deferred too
+    if truncated:
+        slack_client.send_partial_fetch_notification(len(orders), "PayPal <> Shopify Cancelled Orders sync")
 
     if orders:
         csv_data = [['Name', 'Order ID', 'Created At', 'Cancelled At', 'Amount', 'eCheck Status', 'PayPal Refund']]
         log.info(f"Fetched {len(orders)} cancelled orders.")
         log.info("Iterating over each order to process refunds...")
-        for order in orders:
-            log.info(f"Processing for Order: {order['id']}")
-            data_row = paypal_client.process_pending_refunds(order)
-            csv_data.append(data_row)
+        def sync_order(order):
+            # PayPal lookups happen here so the time budget covers them
+            shopify_client.attach_paypal_details(order)
+            return paypal_client.process_pending_refunds(order)
+
+        data_rows, deferred, outcome_unknown = scheduler.run(orders, sync_order, deferrable_errors=(requests.exceptions.Timeout,))
+        csv_data.extend(data_rows)
         
-        # Send report Notification
-        csv_path = slack_client.create_csv_file(csv_data)
-        slack_client.send_csv_to_slack(csv_path, "PayPal <> Shopify Cancelled Orders sync")
+        # Skip the report when the budget ran out before any order was processed
+        if data_rows:
+            # Send report Notification
+            csv_path = slack_client.create_csv_file(csv_data)
+            slack_client.send_csv_to_slack(csv_path, "PayPal <> Shopify Cancelled Orders sync")
+
+            # Send Pretty Table notification to Slack channel
+            tab = PrettyTable(csv_data[0])
+            tab.add_rows(csv_data[1:])
+            slack_client.send_notification(tab)
+
+            log.info(f"Here is the cancelled orders report your requested \n{tab}")
 
-        # Send Pretty Table notification to Slack channel
-        tab = PrettyTable(csv_data[0])
-        tab.add_rows(csv_data[1:])
-        slack_client.send_notification(tab)
+        # Report the orders left for the next run
+        if deferred:
+            deferred_tab = PrettyTable(['Name', 'Order ID', 'Created At', 'Amount', 'Last Chance'])
+            deferred_tab.add_rows(scheduler.order_rows(deferred))
+            slack_client.send_deferred_notification(deferred_tab, "PayPal <> Shopify Cancelled Orders sync")
+            log.info(f"Deferred {len(deferred)} orders to the next run \n{deferred_tab}")
 
-        log.info(f"Here is the cancelled orders report your requested \n{tab}")
+        # Report the orders whose update timed out, they are not retried blindly
+        if outcome_unknown:
+            unknown_tab = PrettyTable(['Name', 'Order ID', 'Created At', 'Amount', 'Last Chance'])
+            unknown_tab.add_rows(scheduler.order_rows(outcome_unknown))
+            slack_client.send_outcome_unknown_notification(unknown_tab, "PayPal <> Shopify Cancelled Orders sync")
+            log.error(f"Outcome unknown for {len(outcome_unknown)} orders \n{unknown_tab}")
 
-    else:
+    elif not truncated:
         log.info("No cancelled orders found.")
 
     log.info(f"Sync Cancelled Orders Job finished at {datetime.now()}")
@@ -0,0 +1,200 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from util.scheduler import BudgetExhausted, OutcomeUnknown, SyncScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def make_order(order_id, created_days_ago, amount, cancelled_days_ago=None, paypal_amount=None):
+    transaction = {'amount': amount}
+    if paypal_amount is not None:
+        transaction['paypal_details'] = {'amount': {'value': paypal_amount}}
+    order = {'id': order_id, 'name': f"#{order_id}", 'createdAt': days_ago(created_days_ago), 'transactions': [transaction]}
+    if cancelled_days_ago is not None:
+        order['cancelledAt'] = days_ago(cancelled_days_ago)
+    return order
+
+
+def ids(orders):
+    return [order['id'] for order in orders]
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    for name in ['SYNC_TIME_BUDGET', 'SYNC_PRIORITY', 'SYNC_RUN_INTERVAL_HOURS']:
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_oldest_priority_sorts_by_created_at():
+    orders = [make_order('a', 5, '1'), make_order('b', 20, '1'), make_order('c', 10, '1')]
+    assert ids(SyncScheduler(priority='oldest').sort_orders(orders)) == ['b', 'c', 'a']
+
+
+def test_oldest_priority_prefers_cancelled_at():
+    orders = [make_order('a', 20, '1', cancelled_days_ago=1), make_order('b', 10, '1', cancelled_days_ago=8)]
+    assert ids(SyncScheduler(priority='oldest').sort_orders(orders)) == ['b', 'a']
+
+
+def test_amount_priority_sorts_highest_first():
+    orders = [make_order('a', 5, '10.00'), make_order('b', 5, '99.50'), make_order('c', 5, '1.00', paypal_amount='500.00')]
+    assert ids(SyncScheduler(priority='amount').sort_orders(orders)) == ['c', 'b', 'a']
+
+
+def test_window_edge_priority_sorts_nearest_edge_first():
+    orders = [make_order('a', 3, '1'), make_order('b', 25, '1'), make_order('c', 12, '1')]
+    assert ids(SyncScheduler(priority='window_edge').sort_orders(orders)) == ['b', 'c', 'a']
+
+
+def test_last_chance_orders_go_first_whatever_the_policy():
+    orders = [make_order('a', 5, '100'), make_order('edge', 29.5, '1')]
+    scheduler = SyncScheduler(priority='amount')
+    assert ids(scheduler.sort_orders(orders)) == ['edge', 'a']
+    assert scheduler.order_rows(orders) == [
+        ['#a', 'a', orders[0]['createdAt'], 100.0, 'No'],
+        ['#edge', 'edge', orders[1]['createdAt'], 1.0, 'Yes'],
+    ]
+
+
+def test_no_budget_processes_every_order():
+    clock = FakeClock()
+    orders = [make_order(str(i), i + 1, '1') for i in range(5)]
+    scheduler = SyncScheduler(clock=clock)
+
+    def handler(order):
+        clock.now += 1000
+        return order['id']
+
+    results, deferred, _ = scheduler.run(orders, handler)
+    assert len(results) == 5
+    assert deferred == []
+    assert scheduler.request_timeout() is None
+
+
+def test_run_defers_when_average_order_no_longer_fits():
+    clock = FakeClock()
+    orders = [make_order(str(i), 10 - i, '1') for i in range(5)]
+    scheduler = SyncScheduler(budget_seconds=10, priority='oldest', clock=clock)
+
+    def handler(order):
+        clock.now += 3
+        return order['id']
+
+    # After three orders 1 second is left, less than the 3 second average
+    results, deferred, _ = scheduler.run(orders, handler)
+    assert results == ['0', '1', '2']
+    assert ids(deferred) == ['3', '4']
+
+
+def test_run_defers_everything_when_budget_spent_before_run():
+    clock = FakeClock()
+    orders = [make_order('a', 1, '1'), make_order('b', 2, '1')]
+    scheduler = SyncScheduler(budget_seconds=5, clock=clock)
+    clock.now = 6
+
+    results, deferred, _ = scheduler.run(orders, lambda order: order['id'])
+    assert results == []
+    assert ids(deferred) == ['b', 'a']
+
+
+def test_run_defers_order_raising_deferrable_error():
+    orders = [make_order('a', 3, '1'), make_order('b', 2, '1'), make_order('c', 1, '1')]
+    scheduler = SyncScheduler(budget_seconds=60, clock=FakeClock())
+
+    def handler(order):
+        if order['id'] == 'b':
+            raise TimeoutError('read timed out')
+        return order['id']
+
+    results, deferred, _ = scheduler.run(orders, handler, deferrable_errors=(TimeoutError,))
+    assert results == ['a']
+    assert ids(deferred) == ['b', 'c']
+
+
+def test_request_timeout_follows_remaining_budget_with_floor():
+    clock = FakeClock()
+    scheduler = SyncScheduler(budget_seconds=30, clock=clock)
+    clock.now = 10
+    assert scheduler.request_timeout() == 20
+    clock.now = 40
+    assert scheduler.request_timeout() == 1.0
+
+
+def test_empty_env_values_count_as_unset(monkeypatch):
+    monkeypatch.setenv('SYNC_TIME_BUDGET', '')
+    monkeypatch.setenv('SYNC_PRIORITY', '')
+    scheduler = SyncScheduler()
+    assert scheduler.budget_seconds is None
+    assert scheduler.priority == 'oldest'
+
+
+@pytest.mark.parametrize('name', ['SYNC_TIME_BUDGET', 'SYNC_RUN_INTERVAL_HOURS'])
+@pytest.mark.parametrize('value', ['abc', '0', '-5', 'nan', 'inf'])
+def test_invalid_budget_is_rejected(monkeypatch, name, value):
+    monkeypatch.setenv(name, value)
+    with pytest.raises(ValueError, match='SYNC_|positive'):
+        SyncScheduler()
+
+
+@pytest.mark.parametrize('kwargs', [{'budget_seconds': float('nan')}, {'budget_seconds': 0}, {'run_interval_hours': 0}, {'run_interval_hours': float('inf')}])
+def test_invalid_arguments_are_rejected(kwargs):
+    with pytest.raises(ValueError, match='positive'):
+        SyncScheduler(**kwargs)
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError, match='Unknown sync priority'):
+        SyncScheduler(priority='newest')
+
+
+def test_run_defers_order_when_budget_spent_before_a_write():
+    clock = FakeClock()
+    orders = [make_order('a', 3, '1'), make_order('b', 2, '1')]
+    scheduler = SyncScheduler(budget_seconds=5, clock=clock)
+
+    def handler(order):
+        # A slow read uses up the budget, the write is not started
+        clock.now += 6
+        scheduler.check_budget()
+        return order['id']
+
+    results, deferred, outcome_unknown = scheduler.run(orders, handler)
+    assert results == []
+    assert ids(deferred) == ['a', 'b']
+    assert outcome_unknown == []
+
+
+def test_run_reports_timed_out_write_as_outcome_unknown():
+    orders = [make_order('a', 3, '1'), make_order('b', 2, '1'), make_order('c', 1, '1')]
+    scheduler = SyncScheduler(budget_seconds=60, clock=FakeClock())
+
+    def handler(order):
+        if order['id'] == 'b':
+            raise OutcomeUnknown('refund request timed out')
+        return order['id']
+
+    results, deferred, outcome_unknown = scheduler.run(orders, handler)
+    assert results == ['a', 'c']
+    assert deferred == []
+    assert ids(outcome_unknown) == ['b']
+
+
+def test_check_budget_raises_only_once_spent():
+    clock = FakeClock()
+    scheduler = SyncScheduler(budget_seconds=5, clock=clock)
+    scheduler.check_budget()
+    clock.now = 5
+    with pytest.raises(BudgetExhausted):
+        scheduler.check_budget()
+    SyncScheduler(clock=clock).check_budget()
@@ -0,0 +1,161 @@
+import os
+import math
+import time
+from datetime import datetime
+from util.logger import get_logger
+
+log = get_logger()
+
+PRIORITY_OLDEST = 'oldest'
+PRIORITY_AMOUNT = 'amount'
+PRIORITY_WINDOW_EDGE = 'window_edge'
+
+# Orders are only fetched from the last 30 days, see query/shopify.py
+SYNC_WINDOW_DAYS = 30
+
+# Gap until the next cron run, orders leaving the window before then get no second chance
+DEFAULT_RUN_INTERVAL_HOURS = 24
+
+# Floor for HTTP timeouts so a request started near the end of the budget can still complete
+MIN_REQUEST_TIMEOUT = 1.0
+
+# Timeout for calls kept out of the budget: the PayPal token fetch and writes, which must not be cut off partway
+FIXED_REQUEST_TIMEOUT = 30.0
+
+class BudgetExhausted(Exception):
+    '''Raised before a write starts once the budget is spent, the order is left untouched'''
+
+class OutcomeUnknown(Exception):
+    '''Raised when a write times out, PayPal or Shopify may have applied it anyway'''
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+
+def _order_amount(order):
+    transaction = order['transactions'][0]
+    paypal_details = transaction.get('paypal_details')
+    if paypal_details:
+        return float(paypal_details['amount']['value'])
+    return float(transaction.get('amount') or 0)
+
+def _oldest_key(order):
+    # Cancelled orders have been waiting on us since the cancellation, pending ones since creation
+    return _parse_date(order.get('cancelledAt') or order['createdAt'])
+
+def _amount_key(order):
+    return -_order_amount(order)
+
+def _window_edge_key(order):
+    # Seconds left before the order falls out of the 30 day fetch window
+    age = datetime.now() - _parse_date(order['createdAt'])
+    return SYNC_WINDOW_DAYS * 86400 - age.total_seconds()
+
+PRIORITY_KEYS = {
+    PRIORITY_OLDEST: _oldest_key,
+    PRIORITY_AMOUNT: _amount_key,
+    PRIORITY_WINDOW_EDGE: _window_edge_key,
+}
+
+def _float_from_env(name, unit):
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number of {unit}, got '{value}'")
+
+def _check_positive(value, name, unit):
+    if value is not None and not (math.isfinite(value) and value > 0):
+        raise ValueError(f"{name} must be a positive number of {unit}, got {value}")
+    return value
+
+class SyncScheduler:
+    '''Runs a handler over orders in priority order until the wall-clock budget runs out'''
+    def __init__(self, budget_seconds=None, priority=None, run_interval_hours=None, clock=time.monotonic) -> None:
+        if budget_seconds is None:
+            budget_seconds = _float_from_env('SYNC_TIME_BUDGET', 'seconds')
+        self.budget_seconds = _check_positive(budget_seconds, 'Sync time budget', 'seconds')
+
+        # Empty values from a .env template count as unset
+        self.priority = priority or os.environ.get('SYNC_PRIORITY') or PRIORITY_OLDEST
+        if self.priority not in PRIORITY_KEYS:
+            raise ValueError(f"Unknown sync priority '{self.priority}', expected one of {list(PRIORITY_KEYS)}")
+
+        if run_interval_hours is None:
+            run_interval_hours = _float_from_env('SYNC_RUN_INTERVAL_HOURS', 'hours')
+        if run_interval_hours is None:
+            run_interval_hours = DEFAULT_RUN_INTERVAL_HOURS
+        self.run_interval_hours = _check_positive(run_interval_hours, 'Sync run interval', 'hours')
+
+        # The clock starts when the job starts, so time spent fetching counts against the budget
+        self.clock = clock
+        self.started_at = self.clock()
+
+    def remaining(self):
+        if self.budget_seconds is None:
+            return None
+        return self.budget_seconds - (self.clock() - self.started_at)
+
+    def request_timeout(self):
+        '''Timeout for a single read-only HTTP call, so a hung PayPal or Shopify request cannot outlive the budget'''
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        return max(remaining, MIN_REQUEST_TIMEOUT)
+
+    def check_budget(self):
+        '''Called before a write, which gets a fixed timeout instead of being cut off by the budget'''
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise BudgetExhausted(f"time budget spent {-remaining:.1f} seconds ago")
+
+    def is_last_chance(self, order):
+        '''True when the order drops out of the fetch window before the next run picks it up'''
+        return _window_edge_key(order) < self.run_interval_hours * 3600
+
+    def sort_orders(self, orders):
+        # Last chance orders go first whatever the policy, deferring them would drop them for good
+        policy_key = PRIORITY_KEYS[self.priority]
+        return sorted(orders, key=lambda order: (not self.is_last_chance(order), policy_key(order)))
+
+    def run(self, orders, handler, deferrable_errors=()):
+        '''Returns the handler results for processed orders, the list of deferred orders and the list of
+        orders whose write timed out. An order whose handler raises BudgetExhausted or one of deferrable_errors
+        (e.g. a read timeout) is deferred along with the rest.'''
+        results = []
+        deferred = []
+        outcome_unknown = []
+        processed_seconds = 0.0
+
+        log.info(f"Scheduling {len(orders)} orders by '{self.priority}' priority with budget {self.budget_seconds} seconds")
+        scheduled = self.sort_orders(orders)
+        for index, order in enumerate(scheduled):
+            remaining = self.remaining()
+            if remaining is not None:
+                # Only start an order if an average one still fits in what is left of the budget
+                average = processed_seconds / len(results) if results else 0.0
+                if remaining <= average:
+                    deferred = scheduled[index:]
+                    log.warning(f"Time budget exhausted with {remaining:.1f} seconds left, deferring {len(deferred)} orders to the next run")
+                    break
+
+            log.info(f"Processing for Order: {order['id']}")
+            order_started_at = self.clock()
+            try:
+                results.append(handler(order))
+            except OutcomeUnknown as e:
+                # Not deferred, the write may have gone through and must be checked by hand
+                log.error(f"Order {order['id']} has an unknown outcome ({e})")
+                outcome_unknown.append(order)
+                continue
+            except (BudgetExhausted, *deferrable_errors) as e:
+                deferred = scheduled[index:]
+                log.warning(f"Order {order['id']} ran out of the time budget ({e}), deferring {len(deferred)} orders to the next run")
+                break
+            processed_seconds += self.clock() - order_started_at
+
+        return results, deferred, outcome_unknown
+
+    def order_rows(self, orders):
+        return [[order['name'], order['id'], order['createdAt'], _order_amount(order), 'Yes' if self.is_last_chance(order) else 'No'] for order in orders]